@@ -1,15 +1,21 @@
+import hmac
 import ipaddress
 import logging
 import os
 import re
+import socket
+import threading
 import time
-import uuid
-from typing import Any, Dict, Optional, Tuple, cast
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, Union, cast
 
+import orjson
 import redis
+import requests
+from cachetools import TTLCache
 from celery import Celery, Task
 from dotenv import load_dotenv
-from flask import Flask, Response, g, jsonify, request
+from flask import Flask, Response, g, request
 from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -20,6 +26,10 @@ load_dotenv()
 
 app = Flask(__name__)
 
+# Cap inbound body size; Kuma payloads are a few KB, anything larger is abuse
+MAX_BODY_BYTES = int(os.environ.get('MAX_BODY_BYTES', 65536))
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY_BYTES
+
 # Configure ProxyFix if behind a reverse proxy
 if os.environ.get('USE_PROXY') == 'true':
     num_proxies = int(os.environ.get('PROXY_FIX_COUNT', 1))
@@ -34,12 +44,30 @@ redis_password = os.environ.get('REDIS_PASSWORD')
 # Celery Configuration
 celery_broker = os.environ.get('CELERY_BROKER_URL', 'redis://redis:6379/0')
 celery = Celery('kumawise', broker=celery_broker)
+PSA_QUEUE = 'psa'
+# msgpack encodes task bodies faster and smaller than the default JSON serializer
+celery.conf.update(
+    task_serializer='msgpack',
+    accept_content=['msgpack'],
+    result_serializer='msgpack',
+    # PSA tasks get their own queue so the worker serving them can be sized
+    # (and rate-limited) independently: celery -A app.celery worker -Q psa
+    task_routes={'app.process_alert_task': {'queue': PSA_QUEUE}},
+)
 
-# Redis Client for Caching and Health Checks
+# Redis Client for Caching and Health Checks.
+# A bounded blocking pool keeps a fixed set of keep-alive sockets shared across
+# threads instead of opening fresh connections under load.
+_redis_pool_kwargs: Dict[str, Any] = {
+    'max_connections': int(os.environ.get('REDIS_MAX_CONN', 64)),
+    'timeout': 2,
+    'socket_keepalive': True,
+    'health_check_interval': 30,
+}
 if redis_password:
-    redis_client = redis.Redis.from_url(celery_broker, password=redis_password)
-else:
-    redis_client = redis.Redis.from_url(celery_broker)
+    _redis_pool_kwargs['password'] = redis_password
+redis_pool = redis.BlockingConnectionPool.from_url(celery_broker, **_redis_pool_kwargs)
+redis_client = redis.Redis(connection_pool=redis_pool)
 
 # Configure logging with Correlation ID (request_id)
 class CorrelationFilter(logging.Filter):
@@ -59,83 +87,185 @@ WEBHOOK_COUNT = Counter('kumawise_webhooks_total', 'Total number of webhooks rec
 PSA_TASK_COUNT = Counter('kumawise_psa_tasks_total', 'Total number of PSA tasks processed', ['type', 'result'])
 PSA_TASK_DURATION = Histogram('kumawise_psa_task_duration_seconds', 'Duration of PSA tasks', ['type'])
 
+# Bind the webhook counter children once so the request path skips the labels() lookup
+WEBHOOK_QUEUED = WEBHOOK_COUNT.labels(status='queued')
+WEBHOOK_FORBIDDEN = WEBHOOK_COUNT.labels(status='forbidden')
+WEBHOOK_UNAUTHORIZED = WEBHOOK_COUNT.labels(status='unauthorized')
+WEBHOOK_BAD_REQUEST = WEBHOOK_COUNT.labels(status='bad_request')
+WEBHOOK_BUSY = WEBHOOK_COUNT.labels(status='busy')
+WEBHOOK_DEDUPED = WEBHOOK_COUNT.labels(status='deduped')
+
+# Same treatment for the task-side metrics used in handle_alert_logic
+PSA_CREATE_SKIPPED = PSA_TASK_COUNT.labels(type='create', result='skipped')
+PSA_CREATE_SUCCESS = PSA_TASK_COUNT.labels(type='create', result='success')
+PSA_CLOSE_SUCCESS = PSA_TASK_COUNT.labels(type='close', result='success')
+PSA_CLOSE_SKIPPED = PSA_TASK_COUNT.labels(type='close', result='skipped')
+PSA_ERROR = {
+    'DOWN': PSA_TASK_COUNT.labels(type='down', result='error'),
+    'UP': PSA_TASK_COUNT.labels(type='up', result='error'),
+}
+PSA_DURATION = {
+    'DOWN': PSA_TASK_DURATION.labels(type='DOWN'),
+    'UP': PSA_TASK_DURATION.labels(type='UP'),
+}
+
 cw_client = ConnectWiseClient()
 
+# Credentials cannot change after process start, so compute this once
+_CW_CONFIGURED = all((
+    cw_client.base_url, cw_client.company, cw_client.public_key, cw_client.private_key, cw_client.client_id
+))
+
 # Cache Key Prefix
 CACHE_PREFIX = "ticket_state:"
 CACHE_TTL = 3600  # 1 hour
+CREATE_LOCK_TTL = 120  # safety window for a single ticket-creation attempt
+
+# Process-local ticket-id cache in front of Redis. A monitor that keeps sending DOWN
+# heartbeats skips even the Redis round-trip. Only the worker that closes a ticket
+# pops its own entry; every other worker holds the stale id until the TTL expires,
+# so the TTL must stay on the DEDUP_SEC scale — any longer and a fresh DOWN after
+# a close would be skipped without creating a ticket. Redis stays the source of truth.
+_LOCAL_TICKET_CACHE: TTLCache[str, str] = TTLCache(maxsize=4096, ttl=30)
+_LOCAL_CACHE_LOCK = threading.RLock()
+
+# Matches the Company ID embedded in monitor names (e.g. "My Server #CW123")
+_CW_COMPANY_RE = re.compile(r'#CW(\w+)')
+
+# Request-path configuration, read once at startup instead of on every call
+USE_CLOUDFLARE = os.environ.get('USE_CLOUDFLARE') == 'true'
+# Pre-encoded to bytes: compare_digest raises TypeError on non-ASCII str input,
+# and the header value is attacker-controlled
+WEBHOOK_SECRETS = frozenset(
+    s.strip().encode('utf-8') for s in (os.environ.get('WEBHOOK_SECRET') or '').split(',') if s.strip()
+)
+CW_TICKET_PREFIX = os.environ.get('CW_TICKET_PREFIX', 'Uptime Kuma Alert:')
+
+def _json_response(payload: Dict[str, Any], status: int = 200) -> Response:
+    """Serializes a response with orjson, skipping Flask's jsonify/stdlib-json path."""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
+# Rejection bodies are static; serialize them once. The correlation ID travels in the
+# X-Request-ID response header instead, so these paths do no per-request encoding.
+_FORBIDDEN_BODY = orjson.dumps({"status": "error", "message": "Forbidden"})
+_UNAUTHORIZED_BODY = orjson.dumps({"status": "error", "message": "Unauthorized"})
+_BAD_REQUEST_BODY = orjson.dumps({"status": "error", "message": "No JSON payload received"})
+_TOO_LARGE_BODY = orjson.dumps({"status": "error", "message": "Payload too large"})
+
+def _static_response(body: bytes, status: int) -> Response:
+    return Response(body, status=status, mimetype='application/json')
 
 @app.before_request
 def set_request_id() -> None:
     """Extract or generate a correlation ID for the request."""
-    req_id = request.headers.get('X-Request-ID') or str(uuid.uuid4())
+    req_id = request.headers.get('X-Request-ID') or os.urandom(12).hex()
     g.request_id = req_id
 
+@app.after_request
+def add_request_id_header(response: Response) -> Response:
+    """Echo the correlation ID on every response."""
+    response.headers['X-Request-ID'] = getattr(g, 'request_id', 'SYS')
+    return response
+
+# Header precedence for the client address, resolved once from config
+_CLIENT_IP_HEADERS = ('CF-Connecting-IP',) if USE_CLOUDFLARE else ()
+
 def get_remote_addr() -> Optional[str]:
     """Returns the effective remote address."""
-    if os.environ.get('USE_CLOUDFLARE') == 'true':
-        cf_ip = request.headers.get('CF-Connecting-IP')
-        if cf_ip:
-            return cf_ip
+    for header in _CLIENT_IP_HEADERS:
+        value = request.headers.get(header)
+        if value:
+            return value
     return request.remote_addr
 
 def handle_alert_logic(data: Dict[str, Any], request_id: str) -> None:
     """
-    Core logic for processing an alert. Uses Redis for state caching to minimize PSA calls.
+    Core logic for processing an alert. Takes the slim payload built by the webhook.
+    Uses Redis for state caching to minimize PSA calls.
     """
     extra = {'request_id': request_id}
     start_time = time.time()
-    heartbeat = data.get('heartbeat', {})
-    monitor = data.get('monitor', {})
-    status = heartbeat.get('status') # 0 = Down, 1 = Up
-    monitor_name = monitor.get('name', 'Unknown Monitor')
+    status = data.get('status') # 0 = Down, 1 = Up
+    monitor_name = data.get('monitor_name', 'Unknown Monitor')
     msg = data.get('msg', 'No message')
-    
+
     alert_type = "DOWN" if status == 0 else "UP"
-    prefix = os.environ.get('CW_TICKET_PREFIX', 'Uptime Kuma Alert:')
-    ticket_summary = f"{prefix} {monitor_name}" if prefix else monitor_name
+    ticket_summary = f"{CW_TICKET_PREFIX} {monitor_name}" if CW_TICKET_PREFIX else monitor_name
     cache_key = f"{CACHE_PREFIX}{monitor_name}"
 
     try:
         if status == 0: # DOWN
-            # 1. Check Redis Cache first
+            # 1. Check the process-local cache, then Redis
+            with _LOCAL_CACHE_LOCK:
+                local_id = _LOCAL_TICKET_CACHE.get(monitor_name)
+            if local_id is not None:
+                logger.info("Ticket for %s found in local cache (ID: %s).", monitor_name, local_id, extra=extra)
+                PSA_CREATE_SKIPPED.inc()
+                return
             # Cast redis_client.get to bytes | None to satisfy mypy
             cached_val = cast(Optional[bytes], redis_client.get(cache_key))
             if cached_val:
-                logger.info(f"Ticket for {monitor_name} found in cache (ID: {cached_val.decode()}).", extra=extra)
-                PSA_TASK_COUNT.labels(type='create', result='skipped').inc()
+                logger.info("Ticket for %s found in cache (ID: %s).", monitor_name, cached_val.decode(), extra=extra)
+                with _LOCAL_CACHE_LOCK:
+                    _LOCAL_TICKET_CACHE[monitor_name] = cached_val.decode()
+                PSA_CREATE_SKIPPED.inc()
+                return
+
+            # 2. Acquire a short-lived creation lock so concurrent workers don't double-create
+            lock_key = f"{CACHE_PREFIX}lock:{monitor_name}"
+            if not redis_client.set(lock_key, request_id, nx=True, ex=CREATE_LOCK_TTL):
+                logger.info("Ticket creation for %s already in flight. Skipping.", monitor_name, extra=extra)
+                PSA_CREATE_SKIPPED.inc()
                 return
 
-            # 2. Check PSA (Safety fallback)
-            logger.info(f"Processing DOWN alert for {monitor_name}", extra=extra)
+            # 3. Check PSA (Safety fallback)
+            logger.info("Processing DOWN alert for %s", monitor_name, extra=extra)
             existing_ticket = cw_client.find_open_ticket(ticket_summary)
             if existing_ticket:
                 ticket_id = existing_ticket['id']
-                logger.info(f"Ticket exists in PSA for {monitor_name} (ID: {ticket_id}). Updating cache.", extra=extra)
-                redis_client.set(cache_key, str(ticket_id), ex=CACHE_TTL)
-                PSA_TASK_COUNT.labels(type='create', result='skipped').inc()
+                logger.info(
+                    "Ticket exists in PSA for %s (ID: %s). Updating cache.", monitor_name, ticket_id, extra=extra
+                )
+                with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.set(cache_key, str(ticket_id), ex=CACHE_TTL)
+                    pipe.delete(lock_key)
+                    pipe.execute()
+                with _LOCAL_CACHE_LOCK:
+                    _LOCAL_TICKET_CACHE[monitor_name] = str(ticket_id)
+                PSA_CREATE_SKIPPED.inc()
                 return
-            
-            # 3. Create Ticket
-            company_id_match = re.search(r'#CW(\w+)', monitor_name)
+
+            # 4. Create Ticket
+            company_id_match = _CW_COMPANY_RE.search(monitor_name)
             company_id = company_id_match.group(1) if company_id_match else None
             description = (
-                f"Monitor: {monitor_name}\nURL: {monitor.get('url', 'N/A')}\n"
-                f"Error: {msg}\nTime: {heartbeat.get('time')}\nRequest ID: {request_id}"
+                f"Monitor: {monitor_name}\nURL: {data.get('url', 'N/A')}\n"
+                f"Error: {msg}\nTime: {data.get('time')}\nRequest ID: {request_id}"
             )
             new_ticket = cw_client.create_ticket(ticket_summary, description, monitor_name, company_id=company_id)
             if new_ticket:
-                redis_client.set(cache_key, str(new_ticket['id']), ex=CACHE_TTL)
-                PSA_TASK_COUNT.labels(type='create', result='success').inc()
+                with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.set(cache_key, str(new_ticket['id']), ex=CACHE_TTL)
+                    pipe.delete(lock_key)
+                    pipe.execute()
+                with _LOCAL_CACHE_LOCK:
+                    _LOCAL_TICKET_CACHE[monitor_name] = str(new_ticket['id'])
+                PSA_CREATE_SUCCESS.inc()
+            else:
+                # Release the lock so the next heartbeat can retry the create
+                redis_client.delete(lock_key)
 
         elif status == 1: # UP
-            logger.info(f"Processing UP alert for {monitor_name}", extra=extra)
+            logger.info("Processing UP alert for %s", monitor_name, extra=extra)
             ticket_id = None
             
-            # 1. Check Cache
-            cached_val = cast(Optional[bytes], redis_client.get(cache_key))
+            # 1. Check Cache. GETDEL fetches and clears the id in one atomic
+            # round-trip, so two workers cannot both claim the same ticket.
+            from_cache = False
+            cached_val = cast(Optional[bytes], redis_client.getdel(cache_key))
             if cached_val:
                 ticket_id = int(cached_val.decode())
+                from_cache = True
             else:
                 # 2. Check PSA
                 existing_ticket = cw_client.find_open_ticket(ticket_summary)
@@ -145,114 +275,284 @@ def handle_alert_logic(data: Dict[str, Any], request_id: str) -> None:
             if ticket_id:
                 resolution = (
                     f"Monitor {monitor_name} is back UP.\nMessage: {msg}\n"
-                    f"Time: {heartbeat.get('time')}\nID: {request_id}"
+                    f"Time: {data.get('time')}\nID: {request_id}"
                 )
                 if cw_client.close_ticket(ticket_id, resolution):
-                    redis_client.delete(cache_key)
-                    PSA_TASK_COUNT.labels(type='close', result='success').inc()
+                    # The just-closed ticket may sit in the client's find cache as
+                    # "open"; a DOWN inside its TTL would write that dead id into
+                    # Redis for CACHE_TTL and suppress creation for up to an hour
+                    cw_client.invalidate_find_cache(ticket_summary)
+                    with _LOCAL_CACHE_LOCK:
+                        _LOCAL_TICKET_CACHE.pop(monitor_name, None)
+                    PSA_CLOSE_SUCCESS.inc()
+                elif from_cache:
+                    # Close failed: restore the entry so the next UP alert can retry
+                    redis_client.set(cache_key, str(ticket_id), ex=CACHE_TTL)
             else:
-                logger.info(f"No open ticket found for {monitor_name} to close.", extra=extra)
-                PSA_TASK_COUNT.labels(type='close', result='skipped').inc()
+                logger.info("No open ticket found for %s to close.", monitor_name, extra=extra)
+                PSA_CLOSE_SKIPPED.inc()
 
-        PSA_TASK_DURATION.labels(type=alert_type).observe(time.time() - start_time)
+        PSA_DURATION[alert_type].observe(time.time() - start_time)
 
     except Exception as exc:
-        logger.error(f"Error processing {alert_type} alert: {exc}", extra=extra)
-        PSA_TASK_COUNT.labels(type=alert_type.lower(), result='error').inc()
+        logger.error("Error processing %s alert: %s", alert_type, exc, extra=extra)
+        PSA_ERROR[alert_type].inc()
         raise exc
 
-@celery.task(bind=True, max_retries=5, default_retry_delay=60, rate_limit=os.environ.get('PSA_RATE_LIMIT', '60/m')) # type: ignore
+@celery.task(  # type: ignore
+    bind=True,
+    max_retries=5,
+    rate_limit=os.environ.get('PSA_RATE_LIMIT', '60/m'),
+    autoretry_for=(requests.RequestException, redis.RedisError),
+    retry_backoff=60,
+    retry_backoff_max=3600,
+    retry_jitter=True,
+)
 def process_alert_task(self: Task, data: Dict[str, Any], request_id: str) -> None:
-    """Celery task wrapper with retry logic."""
+    """Celery task wrapper; transient PSA/Redis failures retry with jittered backoff."""
+    handle_alert_logic(data, request_id)
+
+_IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+def _parse_trusted_ips(trusted_env: Optional[str]) -> Tuple[bool, Tuple[_IPNetwork, ...]]:
+    """Parses TRUSTED_IPS once into (allow_all, networks) so the hot path never re-parses CIDRs."""
+    if not trusted_env or "0.0.0.0/0" in trusted_env:
+        return True, ()
+    networks = []
+    for rule in trusted_env.split(','):
+        rule = rule.strip()
+        if not rule:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(rule, strict=False))
+        except ValueError:
+            logger.warning("Ignoring invalid TRUSTED_IPS rule: %s", rule)
+    return False, tuple(networks)
+
+_TRUST_ALL, _TRUSTED_NETS = _parse_trusted_ips(os.environ.get('TRUSTED_IPS'))
+
+# IPv4 rules reduced to (network, mask) integer pairs: matching is then a mask-and-compare
+# per rule instead of ipaddress containment arithmetic. IPv6 keeps the network objects.
+_V4_RULES = tuple(
+    (int.from_bytes(net.network_address.packed, 'big'), int(net.netmask))
+    for net in _TRUSTED_NETS if net.version == 4
+)
+_V6_NETS = tuple(net for net in _TRUSTED_NETS if net.version == 6)
+
+@lru_cache(maxsize=4096)
+def _ip_trusted_cached(remote_addr: str) -> bool:
     try:
-        handle_alert_logic(data, request_id)
-    except Exception as exc:
-        retry_delay = 2 ** self.request.retries * 60
-        raise self.retry(exc=exc, countdown=retry_delay) from exc
+        ip_int = int.from_bytes(socket.inet_aton(remote_addr), 'big')
+    except OSError:
+        # Not dotted-quad IPv4; fall back to full parsing for IPv6
+        try:
+            client_ip = ipaddress.ip_address(remote_addr)
+        except ValueError:
+            return False
+        return any(client_ip in net for net in _V6_NETS)
+    return any(ip_int & mask == net for net, mask in _V4_RULES)
 
 def is_ip_trusted(remote_addr: str) -> bool:
-    trusted_env = os.environ.get('TRUSTED_IPS')
-    if not trusted_env or "0.0.0.0/0" in trusted_env:
+    # The rule set is fixed at startup, so per-address decisions are safe to memoize.
+    # Trust-all short-circuits before the cache to keep it empty in the default config.
+    if _TRUST_ALL:
         return True
-    try:
-        client_ip = ipaddress.ip_address(remote_addr)
-        for rule in trusted_env.split(','):
-            rule = rule.strip()
-            if not rule:
-                continue
-            if client_ip in ipaddress.ip_network(rule, strict=False):
-                return True
-    except ValueError:
-        return False
-    return False
+    return _ip_trusted_cached(remote_addr)
+
+# Backpressure: stop accepting alerts once the broker queue passes this depth,
+# instead of letting it grow without bound during an incident.
+MAX_QUEUE_DEPTH = int(os.environ.get('MAX_QUEUE_DEPTH', 5000))
+# Kuma repeats DOWN heartbeats every few seconds during an outage; suppress
+# re-enqueueing the same monitor/status combination within this window.
+DEDUP_SEC = int(os.environ.get('DEDUP_SEC', 30))
+_QUEUE_DEPTH_TTL = 1.0  # seconds
+_QUEUE_DEPTH_CACHE: Dict[str, Any] = {'ts': 0.0, 'depth': 0}
+
+def _queue_depth() -> int:
+    """Returns the broker queue depth, cached briefly to avoid hammering Redis."""
+    now = time.time()
+    if now - _QUEUE_DEPTH_CACHE['ts'] > _QUEUE_DEPTH_TTL:
+        try:
+            _QUEUE_DEPTH_CACHE['depth'] = cast(int, redis_client.llen(PSA_QUEUE))
+        except Exception:
+            # Fail open: if the broker is unreachable the enqueue itself will surface it
+            _QUEUE_DEPTH_CACHE['depth'] = 0
+        _QUEUE_DEPTH_CACHE['ts'] = now
+    return cast(int, _QUEUE_DEPTH_CACHE['depth'])
 
 @app.route('/webhook', methods=['POST'])
-def webhook() -> Tuple[Response, int]:
+def webhook() -> Response:
     request_id = g.request_id
     remote_addr = get_remote_addr()
     if remote_addr and not is_ip_trusted(remote_addr):
-        WEBHOOK_COUNT.labels(status='forbidden').inc()
-        return jsonify({"status": "error", "message": "Forbidden", "request_id": request_id}), 403
-
-    webhook_secrets_env = os.environ.get('WEBHOOK_SECRET')
-    if webhook_secrets_env:
-        provided_secret = request.headers.get('X-KumaWise-Secret')
-        trusted_secrets = [s.strip() for s in webhook_secrets_env.split(',') if s.strip()]
-        if provided_secret not in trusted_secrets:
-            WEBHOOK_COUNT.labels(status='unauthorized').inc()
-            return jsonify({"status": "error", "message": "Unauthorized", "request_id": request_id}), 401
-
-    data = request.json
-    if not data:
-        WEBHOOK_COUNT.labels(status='bad_request').inc()
-        return jsonify({"status": "error", "message": "No JSON payload received", "request_id": request_id}), 400
-
-    process_alert_task.delay(data, request_id)
-    WEBHOOK_COUNT.labels(status='queued').inc()
-    return jsonify({"status": "queued", "message": "Alert received", "request_id": request_id}), 202
+        WEBHOOK_FORBIDDEN.inc()
+        return _static_response(_FORBIDDEN_BODY, 403)
+
+    if WEBHOOK_SECRETS:
+        # Werkzeug decodes header values as latin-1; re-encoding the same way
+        # recovers the raw bytes the client sent and can never fail
+        provided_secret = (request.headers.get('X-KumaWise-Secret') or '').encode('latin-1')
+        if not any(hmac.compare_digest(provided_secret, s) for s in WEBHOOK_SECRETS):
+            WEBHOOK_UNAUTHORIZED.inc()
+            return _static_response(_UNAUTHORIZED_BODY, 401)
+
+    # Reject oversize payloads on Content-Length alone, before any body read
+    if request.content_length and request.content_length > MAX_BODY_BYTES:
+        WEBHOOK_BAD_REQUEST.inc()
+        return _static_response(_TOO_LARGE_BODY, 413)
+
+    try:
+        data = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        data = None
+    if not data or not isinstance(data, dict):
+        WEBHOOK_BAD_REQUEST.inc()
+        return _static_response(_BAD_REQUEST_BODY, 400)
+
+    # Strip the Kuma payload down to the fields the task actually reads; the rest
+    # (tags, full monitor config, ...) would only bloat the broker message.
+    heartbeat = data.get('heartbeat') or {}
+    monitor = data.get('monitor') or {}
+    slim = {
+        'status': heartbeat.get('status'),
+        'monitor_name': monitor.get('name', 'Unknown Monitor'),
+        'url': monitor.get('url', 'N/A'),
+        'msg': data.get('msg', 'No message'),
+        'time': heartbeat.get('time'),
+    }
+
+    # Shed load before taking the dedup slot: a request bounced with 503 must not
+    # mark its monitor/status as "already queued", or the client's retry (and every
+    # heartbeat for the next DEDUP_SEC) would be suppressed with nothing enqueued.
+    if _queue_depth() >= MAX_QUEUE_DEPTH:
+        WEBHOOK_BUSY.inc()
+        response = _json_response(
+            {"status": "error", "message": "Queue full, retry later", "request_id": request_id}, 503
+        )
+        response.headers['Retry-After'] = '30'
+        return response
+
+    dedup_key = f"alert_lock:{slim['monitor_name']}:{slim['status']}"
+    try:
+        first_in_window = redis_client.set(dedup_key, '1', nx=True, ex=DEDUP_SEC)
+    except Exception:
+        first_in_window = True  # fail open: dedup is an optimization, not a gate
+    if not first_in_window:
+        WEBHOOK_DEDUPED.inc()
+        return _json_response(
+            {"status": "queued", "message": "Duplicate alert suppressed", "request_id": request_id}, 202
+        )
+
+    try:
+        process_alert_task.delay(slim, request_id)
+    except Exception:
+        # Nothing was enqueued; free the dedup slot so the retry isn't suppressed
+        try:
+            redis_client.delete(dedup_key)
+        except Exception:
+            pass
+        raise
+    WEBHOOK_QUEUED.inc()
+    return _json_response({"status": "queued", "message": "Alert received", "request_id": request_id}, 202)
+
+# Liveness probes hit /health every few seconds; skip the Redis round-trip
+# when the last successful ping is recent enough.
+_HEALTH_PING_TTL = 2  # seconds
+_HEALTH_LAST_OK: Dict[str, float] = {'ts': 0.0}
 
 @app.route('/health', methods=['GET'])
-def health() -> Tuple[Response, int]:
+def health() -> Response:
+    now = time.time()
+    if now - _HEALTH_LAST_OK['ts'] < _HEALTH_PING_TTL:
+        return _json_response({"status": "ok", "timestamp": now})
     try:
         redis_client.ping()
-        return jsonify({"status": "ok", "timestamp": time.time()}), 200
+        _HEALTH_LAST_OK['ts'] = now
+        return _json_response({"status": "ok", "timestamp": now})
+    except Exception:
+        return _json_response({"status": "error", "message": "Redis unreachable"}, 503)
+
+# celery.control.inspect() broadcasts over the broker and blocks for its reply timeout;
+# a background thread keeps a snapshot fresh so /health/detailed never waits on it.
+# The thread starts lazily on the first probe, so Celery workers importing this module
+# never spawn it.
+_DETAILED_HEALTH_TTL = 5  # seconds
+_HEALTH_REFRESH_SEC = int(os.environ.get('HEALTH_REFRESH_SEC', 15))
+_REDIS_PING_CACHE: Dict[str, Any] = {'ts': 0.0, 'ok': False}
+_INSPECT_CACHE: Dict[str, Any] = {'ts': 0.0, 'workers': []}
+_inspect_thread_started = threading.Event()
+_inspect_thread_lock = threading.Lock()
+
+def _refresh_celery_snapshot() -> None:
+    try:
+        active = celery.control.inspect(timeout=0.5).active()
+        _INSPECT_CACHE['workers'] = list(active.keys()) if active else []
     except Exception:
-        return jsonify({"status": "error", "message": "Redis unreachable"}), 503
+        _INSPECT_CACHE['workers'] = []
+    _INSPECT_CACHE['ts'] = time.time()
+
+def _inspect_refresh_loop() -> None:
+    while True:
+        time.sleep(_HEALTH_REFRESH_SEC)
+        _refresh_celery_snapshot()
+
+def _ensure_inspect_thread() -> None:
+    if _inspect_thread_started.is_set():
+        return
+    # Concurrent first probes must not each spawn a permanent refresh loop
+    with _inspect_thread_lock:
+        if _inspect_thread_started.is_set():
+            return
+        _inspect_thread_started.set()
+        # Take one synchronous sample so the first probe reports real state
+        _refresh_celery_snapshot()
+        threading.Thread(target=_inspect_refresh_loop, daemon=True, name='celery-health-refresh').start()
 
 @app.route('/health/detailed', methods=['GET'])
-def health_detailed() -> Tuple[Response, int]:
+def health_detailed() -> Response:
     health_status = "ok"
-    redis_ok = False
-    celery_workers = []
-    try:
-        redis_ok = cast(bool, redis_client.ping())
-    except Exception:
+    now = time.time()
+
+    if now - _REDIS_PING_CACHE['ts'] > _DETAILED_HEALTH_TTL:
+        try:
+            _REDIS_PING_CACHE['ok'] = bool(redis_client.ping())
+        except Exception:
+            _REDIS_PING_CACHE['ok'] = False
+        _REDIS_PING_CACHE['ts'] = now
+    redis_ok = _REDIS_PING_CACHE['ok']
+    if not redis_ok:
         health_status = "error"
-    try:
-        inspector = celery.control.inspect()
-        active = inspector.active()
-        if active:
-            celery_workers = list(active.keys())
-        else:
-            health_status = "error"
-    except Exception:
+
+    _ensure_inspect_thread()
+    celery_workers = _INSPECT_CACHE['workers']
+    if not celery_workers:
         health_status = "error"
-    cw_configured = all([
-        cw_client.base_url, cw_client.company, cw_client.public_key, cw_client.private_key, cw_client.client_id
-    ])
-    return jsonify({
+
+    return _json_response({
         "status": health_status,
         "timestamp": time.time(),
         "services": {
             "redis": {"status": "ok" if redis_ok else "error"},
             "celery": {"status": "ok" if celery_workers else "error", "active_workers": celery_workers},
-            "connectwise": {"configured": cw_configured}
+            "connectwise": {"configured": _CW_CONFIGURED}
         }
-    }), 200 if health_status == "ok" else 503
+    }, 200 if health_status == "ok" else 503)
+
+# generate_latest() walks every collector per scrape; serving cached bytes for a
+# second is invisible at Prometheus scrape intervals but makes the endpoint cheap.
+_METRICS_TTL = 1.0  # seconds
+_METRICS_CACHE: Dict[str, Any] = {'body': b'', 'ts': 0.0}
+_METRICS_LOCK = threading.Lock()
 
 @app.route('/metrics', methods=['GET'])
 def metrics() -> Response:
-    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+    now = time.time()
+    if now - _METRICS_CACHE['ts'] > _METRICS_TTL:
+        with _METRICS_LOCK:
+            if now - _METRICS_CACHE['ts'] > _METRICS_TTL:
+                _METRICS_CACHE['body'] = generate_latest()
+                _METRICS_CACHE['ts'] = time.time()
+    return Response(_METRICS_CACHE['body'], mimetype=CONTENT_TYPE_LATEST)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
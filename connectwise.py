@@ -1,14 +1,67 @@
 import base64
 import logging
 import os
-from typing import Any, Dict, Optional, cast
+import ssl
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, cast
 
+import orjson
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging is configured by the app entrypoint; this module only grabs its logger
 logger = logging.getLogger(__name__)
 
+# One SSLContext shared by every connection pool in the process. Building a
+# context loads and verifies the CA bundle, which urllib3 otherwise repeats per
+# new connection; sharing makes that a one-time cost on reconnects after pool
+# evictions or idle timeouts. (This does not enable TLS session resumption:
+# urllib3 never re-offers a prior session, and Python's ssl module exposes no
+# client-side session cache control.)
+_SSL_CONTEXT = ssl.create_default_context()
+
+
+class _SharedContextAdapter(HTTPAdapter):
+    """HTTPAdapter that hands the module-level SSLContext to its pools."""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        kwargs['ssl_context'] = _SSL_CONTEXT
+        # types-requests leaves the base method unannotated
+        super().init_poolmanager(*args, **kwargs)  # type: ignore[no-untyped-call]
+
+
+def _sanitize_condition_value(value: str) -> str:
+    """Escapes quotes and drops control characters for the conditions DSL.
+
+    An unescaped quote in a monitor name makes ConnectWise reject the search
+    with a 400 on every alert, turning one bad name into a retry storm.
+    """
+    value = ''.join(ch for ch in value if ch.isprintable())
+    return value.replace("'", "\\'")
+
+
+@lru_cache(maxsize=256)
+def _build_find_params(summary: str) -> Tuple[Tuple[str, Any], ...]:
+    """Builds the query params for an open-ticket search, memoized per summary.
+
+    Full ticket objects run to tens of KB; the fields projection keeps only
+    what callers actually read.
+    """
+    return (
+        ("conditions", f"closedFlag=false AND summary contains '{_sanitize_condition_value(summary)}'"),
+        ("pageSize", 1),
+        ("fields", "id,summary,status,closedFlag"),
+    )
+
+
+@lru_cache(maxsize=8)
+def _build_auth_header(company: str, public_key: str, private_key: str) -> str:
+    """Encodes the basic-auth header once per credential set."""
+    auth_string = f"{company}+{public_key}:{private_key}"
+    return f"Basic {base64.b64encode(auth_string.encode()).decode()}"
+
 class ConnectWiseClient:
     """
     A client wrapper for the ConnectWise Manage API (REST).
@@ -24,19 +77,85 @@ class ConnectWiseClient:
         self.service_board_name: str = os.getenv('CW_SERVICE_BOARD', 'Service Board')
         self.status_new: str = os.getenv('CW_STATUS_NEW', 'New')
         self.status_closed: str = os.getenv('CW_STATUS_CLOSED', 'Closed')
+        self.default_company_id: Optional[str] = os.getenv('CW_DEFAULT_COMPANY_ID')
+
+        # Fixed part of every create-ticket payload; per-call fields are merged
+        # in via dict unpacking (callers never mutate the sub-dicts)
+        self._create_template: Dict[str, Any] = {
+            "recordType": "ServiceTicket",
+            "board": {"name": self.service_board_name},
+            "status": {"name": self.status_new},
+        }
         
         if not all([self.base_url, self.company, self.public_key, self.private_key, self.client_id]):
             logger.warning("ConnectWise credentials (including CW_CLIENT_ID) are missing. API calls will fail.")
 
         self.headers: Dict[str, str] = self._get_headers()
 
+        # The session is created lazily per process (see the `session` property):
+        # the module-level client is built before prefork Celery forks its
+        # workers, and sockets/TLS state must not be shared across a fork.
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+
+        # Short-lived cache for open-ticket searches: a DOWN burst for the same
+        # monitor repeats the identical query within seconds. Creation invalidates
+        # the entry; after a close the entry ages out within the TTL.
+        self._find_cache: TTLCache[str, Optional[Dict[str, Any]]] = TTLCache(maxsize=512, ttl=30)
+
+    def _build_session(self) -> requests.Session:
+        """Builds the pooled session used for all API calls.
+
+        HTTP keep-alive avoids a fresh TCP+TLS handshake per call, and carrying
+        the auth headers on the session keeps them off every call site.
+        """
+        session = requests.Session()
+        session.headers.update(self.headers)
+        # Transient 429/5xx and connection failures retry at the HTTP layer with a
+        # short backoff (0.3/0.6/1.2s, honoring Retry-After) instead of surfacing as
+        # a hard failure that forces the caller to replay the whole alert flow.
+        retry = Retry(
+            total=4,
+            connect=3,
+            read=3,
+            status=3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST", "PATCH"]),
+            backoff_factor=0.3,
+            respect_retry_after_header=True,
+        )
+        session.mount('https://', _SharedContextAdapter(
+            pool_connections=4,
+            pool_maxsize=20,
+            max_retries=retry
+        ))
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        """The pooled session for the current process, built on first use.
+
+        Checking os.getpid() makes each forked worker discard the parent's
+        (unusable) connection pool and build its own.
+        """
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            self._session = self._build_session()
+            self._session_pid = pid
+        return self._session
+
+    def close(self) -> None:
+        """Releases the pooled HTTP connections."""
+        if self._session is not None and self._session_pid == os.getpid():
+            self._session.close()
+            self._session = None
+
     def _get_headers(self) -> Dict[str, str]:
         """Constructs the authorization headers."""
         if not self.company or not self.public_key or not self.private_key:
             return {}
             
-        auth_string = f"{self.company}+{self.public_key}:{self.private_key}"
-        auth_header = f"Basic {base64.b64encode(auth_string.encode()).decode()}"
+        auth_header = _build_auth_header(self.company, self.public_key, self.private_key)
         headers = {
             "Authorization": auth_header,
             "Content-Type": "application/json",
@@ -46,64 +165,76 @@ class ConnectWiseClient:
             headers["clientId"] = self.client_id
         return headers
 
+    def invalidate_find_cache(self, summary: str) -> None:
+        """Drops the cached search result for a summary after its ticket changes state.
+
+        close_ticket only knows the ticket id, so the caller that holds the
+        summary invalidates after a successful close; a stale 'open' hit here
+        would otherwise be written through to the Redis ticket cache.
+        """
+        self._find_cache.pop(summary, None)
+
     def find_open_ticket(self, summary_contains: str) -> Optional[Dict[str, Any]]:
         """
         Finds an open ticket with a summary containing the specified text.
+        Results (including misses) are cached briefly; API errors are not.
         """
         try:
-            conditions = f"closedFlag=false AND summary contains '{summary_contains}'"
-            params: Dict[str, Any] = {
-                "conditions": conditions,
-                "pageSize": 1
-            }
+            return self._find_cache[summary_contains]
+        except KeyError:
+            pass
+        try:
+            params = dict(_build_find_params(summary_contains))
             
-            response = requests.get(
-                f"{self.base_url}/service/tickets", 
-                headers=self.headers, 
+            response = self.session.get(
+                f"{self.base_url}/service/tickets",
                 params=params, 
                 timeout=30
             )
             response.raise_for_status()
-            
-            data = response.json()
+
+            data = orjson.loads(response.content)
+            result: Optional[Dict[str, Any]] = None
             if isinstance(data, list) and len(data) > 0:
-                return cast(Dict[str, Any], data[0])
-            return None
-            
+                result = cast(Dict[str, Any], data[0])
+            self._find_cache[summary_contains] = result
+            return result
+
         except requests.exceptions.RequestException as e:
             logger.error(f"Error finding ticket: {e}")
             if e.response:
                 logger.error(f"Response: {e.response.text}")
             return None
 
-    def create_ticket(self, summary: str, description: str, monitor_name: str, 
+    def create_ticket(self, summary: str, description: str, monitor_name: str,
                       company_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         Creates a new service ticket.
         """
         try:
-            payload = {
+            payload: Dict[str, Any] = {
+                **self._create_template,
                 "summary": summary,
-                "recordType": "ServiceTicket",
-                "board": {"name": self.service_board_name},
-                "status": {"name": self.status_new},
                 "initialDescription": description,
             }
             
-            target_company_id = company_id or os.getenv('CW_DEFAULT_COMPANY_ID')
+            target_company_id = company_id or self.default_company_id
             if target_company_id:
                 payload["company"] = {"identifier": target_company_id}
 
-            response = requests.post(
-                f"{self.base_url}/service/tickets", 
-                headers=self.headers, 
-                json=payload, 
+            # The session already carries Content-Type: application/json, so the
+            # stdlib encoder behind the json= kwarg can be bypassed entirely
+            response = self.session.post(
+                f"{self.base_url}/service/tickets",
+                data=orjson.dumps(payload),
                 timeout=30
             )
             response.raise_for_status()
-            
-            ticket = response.json()
+
+            ticket = orjson.loads(response.content)
             logger.info(f"Created ticket #{ticket.get('id')} for {monitor_name}")
+            # The next search for this summary must see the new ticket
+            self._find_cache.pop(summary, None)
             return cast(Dict[str, Any], ticket)
             
         except requests.exceptions.RequestException as e:
@@ -117,34 +248,33 @@ class ConnectWiseClient:
         Closes a ticket by updating its status and adding a resolution note.
         """
         try:
+            # One JSON-Patch covers both the status change and the resolution
+            # note, so closing a ticket is a single round-trip and atomic on
+            # the API side: no closed-without-note state if the second call fails
             patch_payload = [
                 {
                     "op": "replace",
                     "path": "/status/name",
                     "value": self.status_closed
+                },
+                {
+                    "op": "add",
+                    "path": "/notes/-",
+                    "value": {
+                        "text": resolution,
+                        "detailDescriptionFlag": True,
+                        "internalAnalysisFlag": False,
+                        "resolutionFlag": True
+                    }
                 }
             ]
-            
-            response = requests.patch(
-                f"{self.base_url}/service/tickets/{ticket_id}", 
-                headers=self.headers, 
-                json=patch_payload, 
+
+            response = self.session.patch(
+                f"{self.base_url}/service/tickets/{ticket_id}",
+                data=orjson.dumps(patch_payload),
                 timeout=30
             )
             response.raise_for_status()
-            
-            note_payload = {
-                "text": resolution,
-                "detailDescriptionFlag": True,
-                "internalAnalysisFlag": False,
-                "resolutionFlag": True
-            }
-            requests.post(
-                f"{self.base_url}/service/tickets/{ticket_id}/notes", 
-                headers=self.headers, 
-                json=note_payload, 
-                timeout=30
-            )
 
             logger.info(f"Closed ticket #{ticket_id}")
             return True
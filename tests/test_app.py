@@ -25,7 +25,9 @@ def test_health(mock_cw, mock_ping, client):
 def test_health_redis_down(mock_cw, mock_ping, client):
     """Test the health endpoint when Redis is down."""
     mock_ping.side_effect = Exception("Redis connection failed")
-    response = client.get('/health')
+    # Reset the last-OK cache so the endpoint actually re-pings Redis
+    with patch('app._HEALTH_LAST_OK', {'ts': 0.0}):
+        response = client.get('/health')
     assert response.status_code == 503
     assert response.json['status'] == "error"
 
@@ -44,14 +46,77 @@ def test_webhook_queues_task(mock_delay, client):
         "monitor": {"name": "Test Monitor"},
         "msg": "Test"
     }
-    
+
     response = client.post('/webhook', json=payload)
-    
+
     assert response.status_code == 202
     assert response.json['status'] == "queued"
     assert "request_id" in response.json
-    # Verify that the task was queued with the same request_id
-    mock_delay.assert_called_once_with(payload, response.json['request_id'])
+    # Verify that the task was queued with the slim payload and the same request_id
+    expected = {
+        "status": 0,
+        "monitor_name": "Test Monitor",
+        "url": "N/A",
+        "msg": "Test",
+        "time": "2026-01-21 22:00:00",
+    }
+    mock_delay.assert_called_once_with(expected, response.json['request_id'])
+
+@patch('app.redis_client')
+@patch('app.process_alert_task.delay')
+def test_webhook_queue_full(mock_delay, mock_redis, client):
+    """Test that the webhook sheds load with 503 before taking the dedup slot."""
+    mock_redis.llen.return_value = 10000
+    payload = {
+        "heartbeat": {"status": 0, "time": "2026-01-21 22:00:00"},
+        "monitor": {"name": "Busy Monitor"},
+        "msg": "Test"
+    }
+
+    # Reset the depth cache so the endpoint actually re-reads the queue length
+    with patch('app._QUEUE_DEPTH_CACHE', {'ts': 0.0, 'depth': 0}):
+        response = client.post('/webhook', json=payload)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '30'
+    mock_delay.assert_not_called()
+    # A shed request must not consume the dedup slot
+    mock_redis.set.assert_not_called()
+
+@patch('app.redis_client')
+@patch('app.process_alert_task.delay')
+def test_webhook_dedup_suppresses_repeat(mock_delay, mock_redis, client):
+    """Test that a repeated alert inside the dedup window is not re-queued."""
+    mock_redis.llen.return_value = 0
+    mock_redis.set.return_value = None  # SET NX failed: key already present
+    payload = {
+        "heartbeat": {"status": 0, "time": "2026-01-21 22:00:00"},
+        "monitor": {"name": "Flapping Monitor"},
+        "msg": "Test"
+    }
+
+    with patch('app._QUEUE_DEPTH_CACHE', {'ts': 0.0, 'depth': 0}):
+        response = client.post('/webhook', json=payload)
+
+    assert response.status_code == 202
+    assert response.json['message'] == "Duplicate alert suppressed"
+    mock_delay.assert_not_called()
+
+@patch('app.process_alert_task.delay')
+def test_webhook_oversize_body(mock_delay, client):
+    """Test that oversize payloads are rejected with 413."""
+    body = b'{"pad": "' + b'x' * app.config['MAX_CONTENT_LENGTH'] + b'"}'
+    response = client.post('/webhook', data=body, content_type='application/json')
+    assert response.status_code == 413
+    mock_delay.assert_not_called()
+
+@patch('app.process_alert_task.delay')
+def test_webhook_rejects_non_object_json(mock_delay, client):
+    """Test that non-object JSON bodies are rejected with 400."""
+    response = client.post('/webhook', data=b'[1, 2, 3]', content_type='application/json')
+    assert response.status_code == 400
+    assert response.json['status'] == "error"
+    mock_delay.assert_not_called()
 
 @patch('app.redis_client')
 @patch('app.cw_client')
@@ -60,8 +125,8 @@ def test_handle_alert_logic_down_with_cache(mock_cw, mock_redis):
     mock_redis.get.return_value = b"12345"
     
     data = {
-        "heartbeat": {"status": 0},
-        "monitor": {"name": "Cached Monitor"},
+        "status": 0,
+        "monitor_name": "Cached Monitor",
         "msg": "Down"
     }
     
@@ -77,21 +142,21 @@ def test_handle_alert_logic_down_with_cache(mock_cw, mock_redis):
 @patch('app.cw_client')
 def test_handle_alert_logic_up_with_cache(mock_cw, mock_redis):
     """Test UP alert when ticket is in Redis cache."""
-    mock_redis.get.return_value = b"12345"
+    mock_redis.getdel.return_value = b"12345"
     mock_cw.close_ticket.return_value = True
     
     data = {
-        "heartbeat": {"status": 1},
-        "monitor": {"name": "Cached Monitor"},
+        "status": 1,
+        "monitor_name": "Cached Monitor",
         "msg": "Up"
     }
     
     with app.app_context():
         handle_alert_logic(data, "req-123")
     
-    # Should use ID from cache, close ticket, and delete cache key
+    # Should atomically consume the ID from cache and close the ticket
+    mock_redis.getdel.assert_called_once()
     mock_cw.close_ticket.assert_called_once_with(12345, ANY)
-    mock_redis.delete.assert_called_once()
 
 @patch('app.redis_client')
 @patch('app.cw_client')
@@ -101,12 +166,13 @@ def test_handle_alert_logic_custom_prefix(mock_cw, mock_redis):
     mock_cw.find_open_ticket.return_value = None
     
     data = {
-        "heartbeat": {"status": 0, "time": "2026-01-21 22:00:00"},
-        "monitor": {"name": "Test Monitor"},
-        "msg": "Test"
+        "status": 0,
+        "monitor_name": "Test Monitor",
+        "msg": "Test",
+        "time": "2026-01-21 22:00:00"
     }
-    
-    with patch.dict('os.environ', {'CW_TICKET_PREFIX': 'CUSTOM PREFIX:'}):
+
+    with patch('app.CW_TICKET_PREFIX', 'CUSTOM PREFIX:'):
         with app.app_context():
             handle_alert_logic(data, "test-req-id")
             mock_cw.find_open_ticket.assert_called_once_with("CUSTOM PREFIX: Test Monitor")
\ No newline at end of file